@@ -5,10 +5,12 @@ Flask Web 服务
 """
 from flask import Flask, request, jsonify, send_from_directory, send_file
 from pathlib import Path
+import os
 import traceback
 
-from src.config import OUTPUT_DIR
-from src.pipeline import run_query, run_query_without_llm
+from src.config import OSM_PBF, OSM_PREFILTER_KEYS, OUTPUT_DIR
+from src.osm.extractor import prepare_osm_pbf
+from src.pipeline import get_retriever, run_query, run_query_without_llm
 from src.llm.ollama_client import check_ollama_available, list_available_models
 
 app = Flask(__name__)
@@ -22,7 +24,7 @@ def home():
         "endpoints": {
             "POST /chat": "Execute a natural language query",
             "POST /chat_simple": "Execute query without LLM (requires place, key, value)",
-            "GET /output/<filename>": "Get output files (e.g., output.geojson)",
+            "GET /output/<filename>": "Get output files (cache/<entry>.geojson[seq]; output.geojson = latest result)",
             "GET /ui": "Web UI",
             "GET /status": "Check service status",
         }
@@ -54,7 +56,7 @@ def chat():
         {
             "status": "success" | "error",
             "message": "...",
-            "geojson_url": "/output/output.geojson",
+            "geojson_url": "/output/cache/<place>__<hash>.geojson",
             "evidence": [...],
             ...
         }
@@ -102,7 +104,8 @@ def chat():
             "place": result["place"],
             "chosen_tag": result["chosen_tag"],
             "count": result["count"],
-            "geojson_url": "/output/output.geojson",
+            "geojson_url": result["geojson_url"],
+            "geojsonseq_url": result["geojsonseq_url"],
             "evidence": result.get("evidence", []),
             "llm_ok": result["llm_ok"],
             "llm_confidence": result.get("llm_confidence", 0),
@@ -155,7 +158,8 @@ def chat_simple():
         return jsonify({
             "status": "success",
             "message": f"Place: {place}\nTag: {key}={value}\nCount: {result['count']}",
-            "geojson_url": "/output/output.geojson",
+            "geojson_url": result["geojson_url"],
+            "geojsonseq_url": result["geojsonseq_url"],
             "count": result["count"],
         })
         
@@ -169,7 +173,9 @@ def chat_simple():
 
 @app.get("/output/<path:filename>")
 def output_files(filename):
-    """提供输出文件（如 GeoJSON）"""
+    """提供输出文件（如 GeoJSON / GeoJSON Text Sequence）"""
+    if filename.endswith(".geojsonseq"):
+        return send_from_directory(str(OUTPUT_DIR), filename, mimetype="application/geo+json-seq")
     return send_from_directory(str(OUTPUT_DIR), filename)
 
 
@@ -204,8 +210,27 @@ if __name__ == "__main__":
         print("✗ Ollama is not running. Start it with: ollama serve")
         print("  LLM features will not work, but RAG fallback is available.")
     
+    # 一次性预处理 PBF (重新压缩 + 按常用 key 预过滤)，已是最新时直接跳过
+    try:
+        prepare_osm_pbf(OSM_PBF, OSM_PREFILTER_KEYS)
+        print("✓ OSM PBF prepared")
+    except Exception as e:
+        print(f"✗ OSM PBF preparation incomplete: {e}")
+    
+    # 预加载 RAG 检索器，第一个请求无需等待模型和索引加载
+    try:
+        get_retriever()
+    except Exception as e:
+        print(f"✗ Failed to preload FAISS retriever: {e}")
+    
     print("\nStarting server at http://127.0.0.1:8000")
     print("UI available at http://127.0.0.1:8000/ui")
     print("="*60 + "\n")
     
-    app.run(host="127.0.0.1", port=8000, debug=True)
+    if os.environ.get("GEOAI_DEBUG") == "1":
+        # 开发模式: Werkzeug 调试服务器 + 自动重载
+        app.run(host="127.0.0.1", port=8000, debug=True)
+    else:
+        # 生产模式: waitress 多线程 WSGI 服务器，并发处理 /chat 请求
+        from waitress import serve
+        serve(app, host="127.0.0.1", port=8000, threads=8)
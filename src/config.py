@@ -2,6 +2,7 @@
 """
 项目配置文件 - 统一管理所有路径常量
 """
+import os
 from pathlib import Path
 
 # 项目根目录
@@ -14,15 +15,44 @@ DATA_DIR = ROOT / "data"
 # 示例: sweden-latest.osm.pbf
 OSM_PBF = DATA_DIR / "osm" / "sweden-251214.osm.pbf"
 
+# 预处理后的 PBF (重新压缩的副本 + 按常用 key 预过滤的节点文件)
+OSM_PREPARED_DIR = DATA_DIR / "osm" / "prepared"
+OSM_PBF_COMPRESSION = "zstd"
+OSM_PREFILTER_KEYS = ("amenity", "shop", "highway", "building", "railway", "aeroway", "leisure")
+
+# libosmium 解码 PBF 块的线程数 (默认使用全部 CPU 核)
+OSM_POOL_THREADS = int(os.environ.get("GEOAI_OSM_THREADS", os.cpu_count() or 1))
+
 # Wiki 抓取输出目录
 WIKI_RAW_DIR = DATA_DIR / "wiki_raw"
 WIKI_CHUNKS_DIR = DATA_DIR / "wiki_chunks"
 
+# Embedding 模型运行设备 (未设置时自动选择: 有 CUDA 用 cuda + fp16，否则 cpu)
+EMBEDDING_DEVICE = os.environ.get("GEOAI_DEVICE")
+
+# CPU 推理时 torch 的计算线程数 (默认使用全部 CPU 核)
+TORCH_THREADS = int(os.environ.get("GEOAI_TORCH_THREADS", os.cpu_count() or 1))
+
+# 用 torch.compile 编译 Embedding 模型的 transformer (PyTorch 2.x，首次编码会有编译开销)
+TORCH_COMPILE = os.environ.get("GEOAI_TORCH_COMPILE") == "1"
+
+# 查询编码使用 ONNX Runtime (需先用 optimum-cli 导出并量化模型到 ONNX_MODEL_DIR)
+EMBEDDING_USE_ONNX = os.environ.get("GEOAI_USE_ONNX") == "1"
+ONNX_MODEL_DIR = ROOT / "onnx_model"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+
 # FAISS 索引目录
 FAISS_DIR = ROOT / "faiss_index"
 FAISS_INDEX = FAISS_DIR / "faiss_index"
-FAISS_META = FAISS_DIR / "faiss_index.metadata.json"
+FAISS_META = FAISS_DIR / "faiss_index.metadata.parquet"  # 列式存储 (旧版 .json 仍可读取)
+FAISS_HNSW_EF_SEARCH = 16  # HNSW 检索时的候选列表长度 (越大越准、越慢)
 
 # 输出目录
 OUTPUT_DIR = ROOT / "output"
 OUTPUT_GEOJSON = OUTPUT_DIR / "output.geojson"
+OUTPUT_GEOJSONSEQ = OUTPUT_DIR / "output.geojsonseq"  # GeoJSON Text Sequence (RFC 8142)
+
+# 缓存目录 (geocode 结果 + 按 place/tag 缓存的提取结果)
+GEOCODE_CACHE = OUTPUT_DIR / "geocode_cache.json"
+QUERY_CACHE_DIR = OUTPUT_DIR / "cache"
+QUERY_CACHE_TTL_S = 24 * 3600  # 提取结果缓存有效期（秒）
@@ -4,13 +4,33 @@ Ollama LLM 客户端
 用于调用本地 Ollama 服务并解析 JSON 响应
 """
 from __future__ import annotations
+from concurrent.futures import Future
 from dataclasses import dataclass
-from typing import Any, Dict
-import json
+from typing import Any, Dict, Tuple
+import threading
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Ollama 默认配置
 OLLAMA_BASE_URL = "http://127.0.0.1:11434"
+OLLAMA_KEEP_ALIVE = "10m"  # 模型在两次调用之间保持加载，避免重新载入显存
+
+# 复用 HTTP 连接 (keep-alive)，避免每次请求重新建立 TCP 连接
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# 正在进行中的请求: (base_url, model, system, user) -> Future[LLMResult]
+# 相同的并发查询共享同一次 Ollama 调用
+_inflight: Dict[Tuple[str, str, str, str], Future] = {}
+_inflight_lock = threading.Lock()
 
 
 @dataclass
@@ -31,6 +51,10 @@ def call_ollama_json(
     """
     调用 Ollama chat API 并尝试解析 JSON 响应
     
+    多个线程同时发起完全相同的请求时，只有第一个真正调用 Ollama，
+    其余线程等待并复用同一个结果；不同的请求各自并发发送
+    (服务端 OLLAMA_NUM_PARALLEL 决定同时处理的请求数)
+    
     Args:
         model: 模型名称，如 "mistral", "llama2", "qwen2"
         system: 系统提示词
@@ -41,6 +65,38 @@ def call_ollama_json(
     Returns:
         LLMResult: 包含 ok 状态、解析后的数据和原始响应
     """
+    key = (base_url, model, system, user)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[key] = future
+    
+    if not is_owner:
+        return future.result()
+    
+    try:
+        result = _request_ollama_json(model, system, user, timeout_s, base_url)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+    return result
+
+
+def _request_ollama_json(
+    model: str,
+    system: str,
+    user: str,
+    timeout_s: int,
+    base_url: str,
+) -> LLMResult:
+    """实际发送请求到 Ollama /api/chat"""
     url = f"{base_url}/api/chat"
     
     payload = {
@@ -49,18 +105,18 @@ def call_ollama_json(
             {"role": "system", "content": system},
             {"role": "user", "content": user},
         ],
-        "stream": False,  # 不使用流式响应，等待完整结果
+        "stream": True,  # 流式响应，收到完整 JSON 对象即可提前结束
+        "format": "json",  # 约束模型只输出 JSON
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": 0.1,  # 低温度以获得更稳定的 JSON 输出
         }
     }
     
     try:
-        response = requests.post(url, json=payload, timeout=timeout_s)
-        response.raise_for_status()
-        
-        result = response.json()
-        content = result.get("message", {}).get("content", "")
+        with _session.post(url, json=payload, stream=True, timeout=timeout_s) as response:
+            response.raise_for_status()
+            content = _read_streamed_content(response)
         
     except requests.exceptions.ConnectionError:
         return LLMResult(
@@ -83,34 +139,80 @@ def call_ollama_json(
     return _parse_json_from_content(content)
 
 
+class _JsonObjectScanner:
+    """
+    增量跟踪大括号深度，检测流中第一个完整的顶层 JSON 对象
+    字符串内的括号和转义字符不计入深度
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, text: str) -> bool:
+        """输入一段文本，若顶层对象已闭合则返回 True"""
+        for ch in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.depth += 1
+            elif self.depth == 0:
+                continue
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+def _read_streamed_content(response: requests.Response) -> str:
+    """
+    读取 Ollama 流式响应 (每行一个 JSON chunk)，拼接 message.content
+    一旦出现完整的顶层 JSON 对象就停止读取，不再等待剩余的 token
+    """
+    scanner = _JsonObjectScanner()
+    parts = []
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = orjson.loads(line)
+        if "error" in chunk:
+            raise RuntimeError(f"Ollama error: {chunk['error']}")
+        piece = chunk.get("message", {}).get("content", "")
+        parts.append(piece)
+        if scanner.feed(piece) or chunk.get("done"):
+            break
+    return "".join(parts)
+
+
 def _parse_json_from_content(content: str) -> LLMResult:
-    """从 LLM 响应中提取并解析 JSON"""
+    """
+    从 LLM 响应中提取并解析 JSON
     
+    先整体解析；失败时解析第一个 { 到最后一个 } 之间的内容，
+    ```json ... ``` 代码块中的对象也由这一步覆盖
+    """
     # 方法 1: 直接解析整个内容
     try:
-        data = json.loads(content.strip())
-        return LLMResult(ok=True, data=data, raw=content)
-    except json.JSONDecodeError:
+        return LLMResult(ok=True, data=orjson.loads(content), raw=content)
+    except orjson.JSONDecodeError:
         pass
     
-    # 方法 2: 查找 ```json ... ``` 代码块
-    import re
-    json_block_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-    if json_block_match:
-        try:
-            data = json.loads(json_block_match.group(1))
-            return LLMResult(ok=True, data=data, raw=content)
-        except json.JSONDecodeError:
-            pass
-    
-    # 方法 3: 查找第一个 { 到最后一个 } 之间的内容
+    # 方法 2: 查找第一个 { 到最后一个 } 之间的内容
     start = content.find("{")
     end = content.rfind("}")
-    if start != -1 and end != -1 and end > start:
+    if start != -1 and end > start:
         try:
-            data = json.loads(content[start:end + 1])
-            return LLMResult(ok=True, data=data, raw=content)
-        except json.JSONDecodeError:
+            return LLMResult(ok=True, data=orjson.loads(content[start:end + 1]), raw=content)
+        except orjson.JSONDecodeError:
             pass
     
     # 无法解析
@@ -120,7 +222,7 @@ def _parse_json_from_content(content: str) -> LLMResult:
 def check_ollama_available(base_url: str = OLLAMA_BASE_URL) -> bool:
     """检查 Ollama 服务是否可用"""
     try:
-        response = requests.get(f"{base_url}/api/tags", timeout=5)
+        response = _session.get(f"{base_url}/api/tags", timeout=5)
         return response.status_code == 200
     except:
         return False
@@ -129,7 +231,7 @@ def check_ollama_available(base_url: str = OLLAMA_BASE_URL) -> bool:
 def list_available_models(base_url: str = OLLAMA_BASE_URL) -> list:
     """列出可用的模型"""
     try:
-        response = requests.get(f"{base_url}/api/tags", timeout=10)
+        response = _session.get(f"{base_url}/api/tags", timeout=10)
         if response.status_code == 200:
             data = response.json()
             return [m["name"] for m in data.get("models", [])]
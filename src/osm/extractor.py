@@ -1,110 +1,351 @@
 # src/osm/extractor.py
 """
 OSM 数据提取模块
-- osmium 命令行工具提取 bbox 子集
-- pyosmium 解析并提取特定 tag 的节点
+- osmium 命令行工具预处理 PBF（zstd 重压缩、按 key 预过滤）
+- pyosmium 单次扫描按 tag + bbox 提取节点
 """
 from __future__ import annotations
-from dataclasses import dataclass
+from array import array
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-import json
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
 import subprocess
 import shutil
+import tempfile
 
-import osmium
+from src.config import OSM_PBF_COMPRESSION, OSM_POOL_THREADS, OSM_PREPARED_DIR
 
+# libosmium 在内部线程池中并行解压/解码 PBF 块，默认只用 (核数 - 2) 个线程；
+# 线程池在首次读取时创建，因此必须在 import osmium 之前设置。
+# 子进程 (osmium CLI) 会继承该环境变量。
+os.environ.setdefault("OSMIUM_POOL_THREADS", str(OSM_POOL_THREADS))
 
-@dataclass
-class OSMPoint:
-    """表示一个 OSM 节点"""
-    osm_type: str  # "node"
-    osm_id: int
-    lon: float
-    lat: float
-    name: Optional[str]
-    tags: Dict[str, str]
+import orjson
+import osmium
 
 
 class TagNodeHandler(osmium.SimpleHandler):
     """
-    pyosmium Handler: 提取匹配特定 tag 的节点
+    pyosmium Handler: 提取匹配特定 tag 的节点（旧版 pyosmium 的回退路径）
+    匹配结果按列存储 (SoA)：ID/坐标存入 typed array，不为每个节点创建 Python 对象；
+    bbox 判断在复制 tags 之前完成，bbox 外的匹配不会生成 tag 字典
     """
-    def __init__(self, key: str, value: str):
+    def __init__(
+        self,
+        key: str,
+        value: str,
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+    ):
         super().__init__()
         self.key = key
         self.value = value
-        self.rows: List[OSMPoint] = []
+        self.bbox = bbox
+        self._id = array("q")
+        self._lon = array("d")
+        self._lat = array("d")
+        self._tags: List[Dict[str, str]] = []
 
     def node(self, n):
         """处理每个节点"""
-        if n.tags.get(self.key) == self.value and n.location.valid():
-            self.rows.append(
-                OSMPoint(
-                    osm_type="node",
-                    osm_id=int(n.id),
-                    lon=float(n.location.lon),
-                    lat=float(n.location.lat),
-                    name=n.tags.get("name"),
-                    tags=dict(n.tags),
-                )
-            )
-
-
-def osmium_extract_bbox(
+        tags = n.tags
+        if tags.get(self.key) != self.value or not n.location.valid():
+            return
+        location = n.location
+        lon, lat = location.lon, location.lat
+        if self.bbox is not None and not _in_bbox(lon, lat, self.bbox):
+            return
+        self._id.append(n.id)
+        self._lon.append(lon)
+        self._lat.append(lat)
+        self._tags.append(dict(tags))
+
+    def write_to(self, writer: GeoJSONWriter) -> None:
+        """按下标逐个写出匹配的节点"""
+        ids, lons, lats, tags = self._id, self._lon, self._lat, self._tags
+        for i in range(len(ids)):
+            writer.write_node(ids[i], lons[i], lats[i], tags[i])
+
+
+class GeoJSONWriter:
+    """
+    流式 GeoJSON 写出器
+    逐个要素用 orjson 序列化后直接写入文件，不在内存中构建 FeatureCollection
+
+    fmt:
+        "collection": 标准 GeoJSON FeatureCollection
+        "seq": GeoJSON Text Sequence (RFC 8142)，每个要素以 \x1e 开头、换行结尾
+
+    seq_path: 可选，同时写出一份 GeoJSON Text Sequence 副本（每个要素只序列化一次）
+    """
+    FORMATS = ("collection", "seq")
+
+    def __init__(self, out_path: Path, fmt: str = "collection", seq_path: Optional[Path] = None):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown GeoJSON format: {fmt!r}, expected one of {self.FORMATS}")
+        self.out_path = out_path
+        self.fmt = fmt
+        self.seq_path = seq_path
+        self.count = 0
+        self._f = None
+        self._seq_f = None
+
+    def __enter__(self) -> "GeoJSONWriter":
+        self.out_path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.out_path, "wb")
+        if self.fmt == "collection":
+            self._f.write(b'{"type":"FeatureCollection","features":[')
+        if self.seq_path is not None:
+            self.seq_path.parent.mkdir(parents=True, exist_ok=True)
+            self._seq_f = open(self.seq_path, "wb")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.fmt == "collection":
+            self._f.write(b"]}")
+        self._f.close()
+        if self._seq_f is not None:
+            self._seq_f.close()
+
+    def write_node(self, osm_id: int, lon: float, lat: float, tags: Dict[str, str]) -> None:
+        """写出一个点要素"""
+        self._write_feature("node", osm_id, tags, {
+            "type": "Point",
+            "coordinates": [lon, lat],
+        })
+
+    def write_way(self, osm_id: int, coords: List[List[float]], tags: Dict[str, str]) -> None:
+        """写出一个 way：闭合的 way 作为 Polygon，否则作为 LineString"""
+        if len(coords) >= 4 and coords[0] == coords[-1]:
+            geometry = {"type": "Polygon", "coordinates": [coords]}
+        else:
+            geometry = {"type": "LineString", "coordinates": coords}
+        self._write_feature("way", osm_id, tags, geometry)
+
+    def _write_feature(
+        self,
+        osm_type: str,
+        osm_id: int,
+        tags: Dict[str, str],
+        geometry: Dict,
+    ) -> None:
+        feature = orjson.dumps({
+            "type": "Feature",
+            "properties": {
+                "osm_type": osm_type,
+                "osm_id": osm_id,
+                "name": tags.get("name"),
+                "tags": tags,
+            },
+            "geometry": geometry,
+        })
+        if self.fmt == "seq":
+            self._f.write(b"\x1e" + feature + b"\n")
+        elif self.count:
+            self._f.write(b"," + feature)
+        else:
+            self._f.write(feature)
+        if self._seq_f is not None:
+            self._seq_f.write(b"\x1e" + feature + b"\n")
+        self.count += 1
+
+
+def _has_native_filters() -> bool:
+    """pyosmium >= 4.0 提供 FileProcessor 和 C++ 实现的 osmium.filter"""
+    return hasattr(osmium, "FileProcessor") and hasattr(osmium, "filter")
+
+
+def _in_bbox(lon: float, lat: float, bbox: Tuple[float, float, float, float]) -> bool:
+    """判断坐标是否落在 (minlon, minlat, maxlon, maxlat) 边界框内"""
+    minlon, minlat, maxlon, maxlat = bbox
+    return minlon <= lon <= maxlon and minlat <= lat <= maxlat
+
+
+def _scan_nodes_native(
     input_pbf: Path,
-    output_pbf: Path,
-    bbox: Tuple[float, float, float, float]
+    key: str,
+    value: str,
+    writer: GeoJSONWriter,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
 ) -> None:
     """
-    使用 osmium CLI 工具从大 PBF 文件中提取 bbox 区域
-    
-    Args:
-        input_pbf: 输入的 PBF 文件路径
-        output_pbf: 输出的子集 PBF 文件路径
-        bbox: (minlon, minlat, maxlon, maxlat) 边界框
-    
+    使用 FileProcessor + TagFilter 扫描节点
+    tag 比较在 libosmium (C++) 中完成，Python 只处理匹配的对象；
+    bbox 判断只作用于这些少量匹配，因此不需要单独的 extract 步骤
+    匹配的节点直接写入 writer，不构建中间列表
+    """
+    # 只读取 node 实体，way/relation 块不会被解码；
+    # 节点坐标直接来自 DenseNode 块，不需要 location 索引
+    processor = (
+        osmium.FileProcessor(str(input_pbf), osmium.osm.NODE)
+        .with_filter(osmium.filter.TagFilter((key, value)))
+    )
+
+    for obj in processor:
+        if not obj.location.valid():
+            continue
+        lon = float(obj.location.lon)
+        lat = float(obj.location.lat)
+        if bbox is not None and not _in_bbox(lon, lat, bbox):
+            continue
+        writer.write_node(int(obj.id), lon, lat, dict(obj.tags))
+
+
+def _run_osmium(cmd: List[str]) -> bytes:
+    """
+    执行 osmium CLI 子命令，返回 stdout 的原始字节
+
     Raises:
-        FileNotFoundError: 如果找不到输入文件
         RuntimeError: 如果 osmium 执行失败
     """
-    # 检查输入文件
-    if not input_pbf.exists():
-        raise FileNotFoundError(f"Input PBF file not found: {input_pbf}")
-    
-    # 确保输出目录存在
-    output_pbf.parent.mkdir(parents=True, exist_ok=True)
-    
-    # 构建 bbox 字符串: minlon,minlat,maxlon,maxlat
-    bbox_str = ",".join(str(x) for x in bbox)
-    
-    # 使用 shell=True 方式运行命令（解决 Windows 路径问题）
-    cmd = f'osmium extract --bbox {bbox_str} "{input_pbf}" -o "{output_pbf}" -O --set-bounds'
-    
-    print(f"[osmium] Running: {cmd}")
+    print(f"[osmium] Running: {' '.join(cmd)}")
+
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"osmium {cmd[1]} failed with exit code {result.returncode}"
+            f" stderr: {result.stderr.decode(errors='replace')}"
+        )
+    return result.stdout
+
+
+def _osmium_tags_filter(input_pbf: Path, key: str, value: str) -> bytes:
+    """
+    使用 osmium CLI 预先按 tag 过滤节点
+    结果 (一个很小的 PBF) 通过管道写到 stdout，不落盘
+    """
+    return _run_osmium([
+        "osmium", "tags-filter",
+        str(input_pbf), f"n/{key}={value}",
+        "-o", "-", "-f", "pbf",
+    ])
+
+
+def _pbf_stem(pbf: Path) -> str:
+    """sweden-251214.osm.pbf -> sweden-251214"""
+    name = pbf.name
+    return name[:-len(".osm.pbf")] if name.endswith(".osm.pbf") else pbf.stem
+
+
+def _recompressed_pbf_path(src_pbf: Path) -> Path:
+    return OSM_PREPARED_DIR / f"{_pbf_stem(src_pbf)}.{OSM_PBF_COMPRESSION}.osm.pbf"
+
+
+def _key_pbf_path(src_pbf: Path, key: str) -> Path:
+    return OSM_PREPARED_DIR / f"{_pbf_stem(src_pbf)}.{key}.osm.pbf"
+
+
+def _is_fresh(derived: Path, src: Path) -> bool:
+    """派生文件存在且不早于源文件"""
+    return derived.exists() and derived.stat().st_mtime >= src.stat().st_mtime
+
+
+def _run_osmium_atomic(cmd: List[str], output_pbf: Path, output_format: str) -> None:
+    """
+    运行 osmium 并把结果写到 output_pbf
+    先写到同目录的临时文件，成功后再 os.replace；失败或中断时删除残留的临时文件，
+    避免被截断的文件被 _is_fresh 当作有效的预处理结果
+    """
+    tmp_pbf = output_pbf.with_name(f".{output_pbf.name}.partial")
+    try:
+        _run_osmium(cmd + ["-o", str(tmp_pbf), "-O", "-f", output_format])
+        os.replace(tmp_pbf, output_pbf)
+    except BaseException:
+        tmp_pbf.unlink(missing_ok=True)
+        raise
+
+
+def prepare_osm_pbf(src_pbf: Path, keys: Iterable[str] = ()) -> None:
+    """
+    一次性预处理 PBF，加速后续每次查询
+    - 用 OSM_PBF_COMPRESSION 重新压缩一份副本 (解码更快)
+    - 对每个 key 预先过滤出带该 key 的节点 (文件小一个数量级)
+    两者都直接从源文件生成、互不依赖；osmium 不支持 OSM_PBF_COMPRESSION 时
+    key 文件改用默认压缩。已存在且比源文件新的结果会被跳过；需要 osmium CLI
     
-    result = subprocess.run(
-        cmd,
-        shell=True,
-        capture_output=True,
-        text=True,
-    )
+    Raises:
+        FileNotFoundError: 如果找不到输入文件
+        RuntimeError: 如果找不到 osmium，或有文件生成失败 (其余文件仍会生成)
+    """
+    if not src_pbf.exists():
+        raise FileNotFoundError(f"Input PBF file not found: {src_pbf}")
+    if shutil.which("osmium") is None:
+        raise RuntimeError("osmium CLI not found in PATH (conda install -c conda-forge osmium-tool)")
     
-    if result.returncode != 0:
-        error_msg = f"osmium extract failed with exit code {result.returncode}"
-        if result.stderr:
-            error_msg += f" stderr: {result.stderr}"
-        if result.stdout:
-            error_msg += f" stdout: {result.stdout}"
-        raise RuntimeError(error_msg)
+    OSM_PREPARED_DIR.mkdir(parents=True, exist_ok=True)
+    output_format = f"pbf,pbf_compression={OSM_PBF_COMPRESSION}"
+    errors: List[str] = []
     
-    if result.stderr:
-        print(f"[osmium] stderr: {result.stderr}")
+    recompressed = _recompressed_pbf_path(src_pbf)
+    if not _is_fresh(recompressed, src_pbf):
+        try:
+            _run_osmium_atomic(["osmium", "cat", str(src_pbf)], recompressed, output_format)
+        except RuntimeError as e:
+            errors.append(f"{recompressed.name}: {e}")
     
-    if not output_pbf.exists():
-        raise RuntimeError(f"osmium completed but output file not created: {output_pbf}")
+    for key in keys:
+        key_pbf = _key_pbf_path(src_pbf, key)
+        if _is_fresh(key_pbf, src_pbf):
+            continue
+        cmd = ["osmium", "tags-filter", str(src_pbf), f"n/{key}"]
+        try:
+            _run_osmium_atomic(cmd, key_pbf, output_format)
+        except RuntimeError:
+            try:
+                _run_osmium_atomic(cmd, key_pbf, "pbf")
+            except RuntimeError as e:
+                errors.append(f"{key_pbf.name}: {e}")
     
-    print(f"[osmium] Successfully extracted to {output_pbf}")
+    if errors:
+        raise RuntimeError("Some prepared PBFs could not be built: " + "; ".join(errors))
+
+
+def resolve_pbf_for_key(src_pbf: Path, key: str) -> Path:
+    """
+    返回提取 key 节点时应读取的 PBF：
+    预过滤的 key 文件 > 重新压缩的副本 > 原始文件 (只使用比源文件新的派生文件)
+    """
+    if not src_pbf.exists():
+        return src_pbf
+    for candidate in (_key_pbf_path(src_pbf, key), _recompressed_pbf_path(src_pbf)):
+        if _is_fresh(candidate, src_pbf):
+            return candidate
+    return src_pbf
+
+
+def _scan_nodes_with_handler(
+    input_pbf: Path,
+    key: str,
+    value: str,
+    writer: GeoJSONWriter,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> None:
+    """
+    旧版 pyosmium 的回退路径
+    如果系统装有 osmium CLI，先用 tags-filter 过滤，结果经管道直接在内存中解析，
+    这样 Python 回调只需要处理匹配的节点
+    """
+    handler = TagNodeHandler(key, value, bbox)
+
+    if shutil.which("osmium") is None:
+        handler.apply_file(str(input_pbf))
+    else:
+        handler.apply_buffer(_osmium_tags_filter(input_pbf, key, value), "pbf")
+
+    handler.write_to(writer)
+
+
+def _scan_nodes(
+    input_pbf: Path,
+    key: str,
+    value: str,
+    writer: GeoJSONWriter,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+) -> None:
+    """根据已安装的 pyosmium 版本选择扫描实现，结果写入 writer"""
+    if _has_native_filters():
+        _scan_nodes_native(input_pbf, key, value, writer, bbox)
+    else:
+        _scan_nodes_with_handler(input_pbf, key, value, writer, bbox)
 
 
 def extract_nodes_to_geojson(
@@ -112,60 +353,67 @@ def extract_nodes_to_geojson(
     key: str,
     value: str,
     out_geojson: Path,
-) -> List[OSMPoint]:
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    fmt: str = "collection",
+    seq_path: Optional[Path] = None,
+) -> int:
     """
-    从 PBF 文件中提取匹配 key=value 的节点，保存为 GeoJSON
+    从 PBF 文件中提取匹配 key=value 的节点，流式保存为 GeoJSON
+    
+    给定 bbox 时在同一次扫描中完成裁剪：tag 过滤在 libosmium 中进行，
+    bbox 判断只作用于匹配的节点，不需要先用 osmium extract 生成 sub PBF
     
     Args:
-        input_pbf: 输入的 PBF 文件
+        input_pbf: 输入的 PBF 文件（可以是整个国家）
         key: OSM tag 键，如 "amenity"
         value: OSM tag 值，如 "cafe"
         out_geojson: 输出的 GeoJSON 文件路径
+        bbox: 可选的 (minlon, minlat, maxlon, maxlat) 边界框
+        fmt: "collection" (FeatureCollection) 或 "seq" (GeoJSON Text Sequence)
+        seq_path: 可选，同时写出的 GeoJSON Text Sequence (.geojsonseq) 文件路径
     
     Returns:
-        提取到的 OSMPoint 列表
+        提取到的节点数量
     """
     if not input_pbf.exists():
         raise FileNotFoundError(f"Input PBF file not found: {input_pbf}")
     
-    print(f"[extractor] Scanning {input_pbf} for {key}={value}")
+    where = f" in bbox {bbox}" if bbox is not None else ""
+    print(f"[extractor] Scanning {input_pbf} for {key}={value}{where}")
     
-    handler = TagNodeHandler(key, value)
-    handler.apply_file(str(input_pbf), locations=True)
+    with GeoJSONWriter(out_geojson, fmt, seq_path) as writer:
+        _scan_nodes(input_pbf, key, value, writer, bbox)
     
-    print(f"[extractor] Found {len(handler.rows)} nodes")
+    print(f"[extractor] Found {writer.count} nodes, saved GeoJSON to {out_geojson}")
     
-    # 转换为 GeoJSON FeatureCollection
-    features = []
-    for point in handler.rows:
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "osm_type": point.osm_type,
-                "osm_id": point.osm_id,
-                "name": point.name,
-                "tags": point.tags,
-            },
-            "geometry": {
-                "type": "Point",
-                "coordinates": [point.lon, point.lat],
-            },
-        }
-        features.append(feature)
-    
-    feature_collection = {
-        "type": "FeatureCollection",
-        "features": features,
-    }
-    
-    # 保存 GeoJSON
-    out_geojson.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_geojson, "w", encoding="utf-8") as f:
-        json.dump(feature_collection, f, ensure_ascii=False, indent=2)
-    
-    print(f"[extractor] Saved GeoJSON to {out_geojson}")
+    return writer.count
+
+
+def extract_nodes_for_key(
+    src_pbf: Path,
+    key: str,
+    value: str,
+    out_geojson: Path,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    fmt: str = "collection",
+    seq_path: Optional[Path] = None,
+) -> int:
+    """
+    与 extract_nodes_to_geojson 相同，但优先读取 prepare_osm_pbf 生成的文件
+    (resolve_pbf_for_key)；预处理文件读取失败时 (例如 pyosmium 无法解码 zstd 块)
+    回退到原始 PBF 重新提取
     
-    return handler.rows
+    Returns:
+        提取到的节点数量
+    """
+    input_pbf = resolve_pbf_for_key(src_pbf, key)
+    try:
+        return extract_nodes_to_geojson(input_pbf, key, value, out_geojson, bbox, fmt, seq_path)
+    except Exception as e:
+        if input_pbf == src_pbf:
+            raise
+        print(f"[extractor] Reading {input_pbf.name} failed ({e}), falling back to {src_pbf.name}")
+        return extract_nodes_to_geojson(src_pbf, key, value, out_geojson, bbox, fmt, seq_path)
 
 
 def extract_ways_to_geojson(
@@ -173,10 +421,56 @@ def extract_ways_to_geojson(
     key: str,
     value: str,
     out_geojson: Path,
+    fmt: str = "collection",
 ) -> int:
     """
-    提取匹配的 ways（线要素）- 可选扩展
-    这里只是一个占位，可以根据需要实现
+    提取匹配 key=value 的 ways（线/面要素），流式保存为 GeoJSON
+    
+    way 的几何需要解析节点坐标，这里使用基于磁盘文件的
+    dense_file_array 索引，而不是默认的内存索引，以控制大 PBF 的内存占用
+    
+    Args:
+        input_pbf: 输入的 PBF 文件
+        key: OSM tag 键，如 "building"
+        value: OSM tag 值，如 "school"
+        out_geojson: 输出的 GeoJSON 文件路径
+        fmt: "collection" (FeatureCollection) 或 "seq" (GeoJSON Text Sequence)
+    
+    Returns:
+        提取到的 way 数量
+    
+    Raises:
+        RuntimeError: 如果 pyosmium 版本过旧 (< 4.0)
     """
-    # TODO: 实现 way 提取逻辑
-    raise NotImplementedError("Way extraction not yet implemented")
+    if not input_pbf.exists():
+        raise FileNotFoundError(f"Input PBF file not found: {input_pbf}")
+    if not _has_native_filters():
+        raise RuntimeError("Way extraction requires pyosmium >= 4.0")
+    
+    print(f"[extractor] Scanning {input_pbf} for ways with {key}={value}")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir, GeoJSONWriter(out_geojson, fmt) as writer:
+        locations = osmium.index.create_map(
+            f"dense_file_array,{Path(tmp_dir) / 'locations.bin'}"
+        )
+        # location 索引在过滤器之前执行，因此所有节点坐标都会被记录
+        processor = (
+            osmium.FileProcessor(str(input_pbf), osmium.osm.NODE | osmium.osm.WAY)
+            .with_locations(locations)
+            .with_filter(osmium.filter.EntityFilter(osmium.osm.WAY))
+            .with_filter(osmium.filter.TagFilter((key, value)))
+        )
+        for way in processor:
+            coords = [
+                [float(n.lon), float(n.lat)]
+                for n in way.nodes
+                if n.location.valid()
+            ]
+            if len(coords) >= 2:
+                writer.write_way(int(way.id), coords, dict(way.tags))
+        # 先释放索引文件句柄，临时目录才能被删除 (Windows)
+        del processor, locations
+    
+    print(f"[extractor] Found {writer.count} ways, saved GeoJSON to {out_geojson}")
+    
+    return writer.count
@@ -4,9 +4,92 @@
 使用 OpenStreetMap Nominatim API
 """
 from __future__ import annotations
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import uuid
 import requests
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.config import GEOCODE_CACHE
+
+# 复用到 Nominatim 的 HTTPS 连接 (keep-alive)，省去每次请求的 TCP + TLS 握手
+_session = requests.Session()
+_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    ),
+)
+
+# Nominatim 使用政策: 最多 1 req/s
+# 在发送请求前等待 (而不是在响应后 sleep)，不占用调用方的响应时间
+_last_request_at = 0.0
+_rate_lock = threading.Lock()
+
+# bbox 缓存: 规范化地名 -> [minlon, minlat, maxlon, maxlat]
+# 首次使用时从 GEOCODE_CACHE 加载，未命中时写回磁盘
+_bbox_cache: Optional[Dict[str, List[float]]] = None
+_bbox_cache_lock = threading.Lock()
+
+
+def _wait_for_request_slot(min_interval_s: float) -> None:
+    """阻塞到距上一次 Nominatim 请求至少 min_interval_s 秒"""
+    global _last_request_at
+    with _rate_lock:
+        wait = _last_request_at + min_interval_s - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        _last_request_at = time.monotonic()
+
+
+def _cache_key(place: str) -> str:
+    return " ".join(place.lower().split())
+
+
+def _get_bbox_cache() -> Dict[str, List[float]]:
+    """加载磁盘上的 geocode 缓存（只加载一次）"""
+    global _bbox_cache
+    if _bbox_cache is None:
+        try:
+            with open(GEOCODE_CACHE, "r", encoding="utf-8") as f:
+                _bbox_cache = json.load(f)
+        except (OSError, ValueError):
+            _bbox_cache = {}
+    return _bbox_cache
+
+
+def _store_bbox(place: str, bbox: Tuple[float, float, float, float]) -> None:
+    """写入缓存并持久化到 GEOCODE_CACHE
+
+    写之前先合并磁盘上的内容（其它进程可能已写入新条目），
+    再写临时文件 + os.replace 原子替换，读者不会看到半写的 JSON
+    """
+    with _bbox_cache_lock:
+        cache = _get_bbox_cache()
+        try:
+            with open(GEOCODE_CACHE, "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+            if isinstance(on_disk, dict):
+                for k, v in on_disk.items():
+                    cache.setdefault(k, v)
+        except (OSError, ValueError):
+            pass
+        cache[_cache_key(place)] = list(bbox)
+        GEOCODE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = GEOCODE_CACHE.with_name(f".{GEOCODE_CACHE.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, GEOCODE_CACHE)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
 
 
 def geocode_to_bbox(
@@ -17,9 +100,11 @@ def geocode_to_bbox(
     """
     将地名转换为边界框坐标
     
+    结果会缓存到 GEOCODE_CACHE，命中缓存时不请求 Nominatim
+    
     Args:
         place: 地名，如 "Lund", "Malmö", "Stockholm"
-        sleep_s: 请求后等待时间（遵守 Nominatim 使用政策）
+        sleep_s: 两次 Nominatim 请求之间的最小间隔（遵守 Nominatim 使用政策）
         timeout: 请求超时时间
     
     Returns:
@@ -29,6 +114,12 @@ def geocode_to_bbox(
         ValueError: 如果找不到该地名
         requests.RequestException: 如果请求失败
     """
+    with _bbox_cache_lock:
+        cached = _get_bbox_cache().get(_cache_key(place))
+    if cached is not None:
+        print(f"[Geocode] Cache hit: {place}")
+        return tuple(cached)
+    
     url = "https://nominatim.openstreetmap.org/search"
     
     params = {
@@ -43,7 +134,8 @@ def geocode_to_bbox(
 
     print(f"[Geocode] Looking up: {place}")
     
-    response = requests.get(
+    _wait_for_request_slot(sleep_s)
+    response = _session.get(
         url,
         params=params,
         headers=headers,
@@ -80,10 +172,10 @@ def geocode_to_bbox(
     
     print(f"[Geocode] Found: center=({lat:.4f}, {lon:.4f}), bbox=({minlon:.4f}, {minlat:.4f}, {maxlon:.4f}, {maxlat:.4f})")
     
-    # 遵守 Nominatim 使用政策
-    time.sleep(sleep_s)
+    result = (minlon, minlat, maxlon, maxlat)
+    _store_bbox(place, result)
     
-    return (minlon, minlat, maxlon, maxlat)
+    return result
 
 
 def geocode_to_center(
@@ -94,6 +186,9 @@ def geocode_to_center(
     """
     将地名转换为中心坐标
     
+    Args:
+        sleep_s: 两次 Nominatim 请求之间的最小间隔
+    
     Returns:
         (lon, lat) 中心坐标
     """
@@ -109,7 +204,8 @@ def geocode_to_center(
         "User-Agent": "GeoAI-OSM-RAG/1.0 (educational project)"
     }
 
-    response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    _wait_for_request_slot(sleep_s)
+    response = _session.get(url, params=params, headers=headers, timeout=timeout)
     response.raise_for_status()
     
     data = response.json()
@@ -121,6 +217,4 @@ def geocode_to_center(
     lat = float(item["lat"])
     lon = float(item["lon"])
     
-    time.sleep(sleep_s)
-    
     return (lon, lat)
@@ -4,17 +4,52 @@
 """
 from pathlib import Path
 from typing import Dict, Any, Optional
+import hashlib
+import json
+import os
 import re
+import shutil
+import threading
+import time
 import unicodedata
+import uuid
 
-from src.config import OSM_PBF, OUTPUT_DIR, OUTPUT_GEOJSON
+from src.config import (
+    OSM_PBF, OUTPUT_DIR, OUTPUT_GEOJSON, OUTPUT_GEOJSONSEQ, QUERY_CACHE_DIR, QUERY_CACHE_TTL_S,
+)
 from src.rag.retriever import FaissRetriever, pick_tag_from_chunks
-from src.osm.extractor import extract_nodes_to_geojson, osmium_extract_bbox
+from src.osm.extractor import extract_nodes_for_key
 from src.osm.geocode import geocode_to_bbox
 from src.query.llm_parser import llm_parse_query, validate_llm_response
 
 DEFAULT_PLACE = "Lund"
 
+# 进程内共享的检索器（加载模型 + FAISS 索引代价较高，只做一次）
+_RETRIEVER: Optional[FaissRetriever] = None
+_RETRIEVER_LOCK = threading.Lock()
+
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+# 地点提取规则: 匹配 "in <Place>" 等模式
+_PLACE_RES = [
+    re.compile(p, re.IGNORECASE)
+    for p in (
+        r"\bin\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})$",  # "in Malmö"
+        r"\bin\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})\s*$",
+        r"(?:from|at|near)\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})$",
+    )
+]
+
+
+def get_retriever() -> FaissRetriever:
+    """返回共享的 FaissRetriever，首次调用时加载（线程安全）"""
+    global _RETRIEVER
+    if _RETRIEVER is None:
+        with _RETRIEVER_LOCK:
+            if _RETRIEVER is None:
+                _RETRIEVER = FaissRetriever()
+    return _RETRIEVER
+
 
 def safe_slug(text: str) -> str:
     """
@@ -27,7 +62,7 @@ def safe_slug(text: str) -> str:
     text = unicodedata.normalize('NFKD', text)
     text = text.encode('ascii', 'ignore').decode('ascii')
     # 替换空格和特殊字符
-    text = re.sub(r'[^a-z0-9]+', '_', text)
+    text = _SLUG_RE.sub('_', text)
     # 移除首尾下划线
     text = text.strip('_')
     return text or "unknown"
@@ -38,20 +73,115 @@ def simple_place_heuristic(query: str) -> Optional[str]:
     简单的地点提取规则
     匹配 "in <Place>" 模式
     """
-    patterns = [
-        r"\bin\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})$",  # "in Malmö"
-        r"\bin\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})\s*$",
-        r"(?:from|at|near)\s+([A-Za-zÅÄÖåäöØøÆæ\-\s]{2,})$",
-    ]
-    
     query_clean = query.strip()
-    for pattern in patterns:
-        m = re.search(pattern, query_clean, re.IGNORECASE)
+    for place_re in _PLACE_RES:
+        m = place_re.search(query_clean)
         if m:
             return m.group(1).strip()
     return None
 
 
+def _cache_paths(place: str, key: str, value: str):
+    """
+    返回 (place, key, value) 对应的缓存 .geojson / .geojsonseq 和 sidecar 元数据路径
+    文件名用规范化后 (place 忽略大小写和多余空白，tag 原样) 的 sha1，
+    slug 前缀只为了便于辨认 (非拉丁地名的 slug 都是 "unknown"，不能作为键)
+    """
+    normalized = "\x1f".join((" ".join(place.lower().split()), key, value))
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+    stem = f"{safe_slug(place)}__{digest}"
+    return (
+        QUERY_CACHE_DIR / f"{stem}.geojson",
+        QUERY_CACHE_DIR / f"{stem}.geojsonseq",
+        QUERY_CACHE_DIR / f"{stem}.meta.json",
+    )
+
+
+def _tmp_path(path: Path) -> Path:
+    """path 同目录下的唯一临时文件名 (写完后 os.replace 到 path)"""
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def _atomic_copy(src: Path, dst: Path) -> None:
+    """先复制到临时文件再 os.replace，读者不会看到写了一半的文件"""
+    tmp = _tmp_path(dst)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _result_files(place: str, key: str, value: str) -> Dict[str, str]:
+    """
+    本次结果在缓存中的文件路径和下载 URL (/output/cache/...)
+    每个 (place, key, value) 一份，不会被其他并发请求覆盖；
+    OUTPUT_GEOJSON / OUTPUT_GEOJSONSEQ 只作为“最近一次结果”的旧别名保留
+    """
+    geojson_path, seq_path, _ = _cache_paths(place, key, value)
+    return {
+        "geojson_path": str(geojson_path),
+        "geojsonseq_path": str(seq_path),
+        "geojson_url": "/output/" + geojson_path.relative_to(OUTPUT_DIR).as_posix(),
+        "geojsonseq_url": "/output/" + seq_path.relative_to(OUTPUT_DIR).as_posix(),
+    }
+
+
+def _publish_extract(geojson_path: Path, seq_path: Path) -> None:
+    """把缓存中的提取结果发布到 OUTPUT_GEOJSON / OUTPUT_GEOJSONSEQ (供 /output 下载)"""
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    _atomic_copy(seq_path, OUTPUT_GEOJSONSEQ)
+    _atomic_copy(geojson_path, OUTPUT_GEOJSON)
+
+
+def _load_cached_extract(place: str, key: str, value: str) -> Optional[Dict[str, Any]]:
+    """
+    查找未过期的提取结果缓存
+    命中时把缓存的文件复制到 OUTPUT_GEOJSON / OUTPUT_GEOJSONSEQ，并返回 {"bbox", "count"}
+    """
+    geojson_path, seq_path, meta_path = _cache_paths(place, key, value)
+    try:
+        if time.time() - geojson_path.stat().st_mtime > QUERY_CACHE_TTL_S:
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        _publish_extract(geojson_path, seq_path)
+    except (OSError, ValueError):
+        return None
+    
+    print(f"[Pipeline] Cache hit: {geojson_path.name}")
+    return {"bbox": tuple(meta["bbox"]), "count": meta["count"]}
+
+
+def _extract_to_cache(place: str, key: str, value: str, bbox) -> int:
+    """
+    提取节点直接写入 (place, key, value) 自己的缓存条目，再发布到输出文件
+    每个请求写自己的临时文件并 os.replace，并发请求之间不会互相覆盖或混写
+    
+    Returns:
+        提取到的节点数量
+    """
+    geojson_path, seq_path, meta_path = _cache_paths(place, key, value)
+    QUERY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_geojson, tmp_seq, tmp_meta = _tmp_path(geojson_path), _tmp_path(seq_path), _tmp_path(meta_path)
+    try:
+        count = extract_nodes_for_key(
+            Path(OSM_PBF), key, value, tmp_geojson, bbox=bbox, seq_path=tmp_seq,
+        )
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"bbox": list(bbox), "count": count}, f)
+        # .geojson 最后替换：它的 mtime 决定缓存是否有效
+        os.replace(tmp_seq, seq_path)
+        os.replace(tmp_meta, meta_path)
+        os.replace(tmp_geojson, geojson_path)
+    finally:
+        for tmp in (tmp_geojson, tmp_seq, tmp_meta):
+            tmp.unlink(missing_ok=True)
+    
+    _publish_extract(geojson_path, seq_path)
+    return count
+
+
 def run_query(query: str, model: str = "mistral") -> Dict[str, Any]:
     """
     执行完整的查询流程
@@ -68,7 +198,7 @@ def run_query(query: str, model: str = "mistral") -> Dict[str, Any]:
     # ========== Step 1: RAG 检索 ==========
     print(f"[Pipeline] Step 1: RAG retrieval for query: {query}")
     try:
-        retriever = FaissRetriever()
+        retriever = get_retriever()
         chunks = retriever.retrieve(query, k=5)
         print(f"[Pipeline] Retrieved {len(chunks)} chunks")
     except Exception as e:
@@ -122,48 +252,36 @@ def run_query(query: str, model: str = "mistral") -> Dict[str, Any]:
                 "success": False
             }
     
-    # ========== Step 5: Geocode -> BBox ==========
-    print(f"[Pipeline] Step 5: Geocoding {place}")
-    try:
-        bbox = geocode_to_bbox(place)
-        print(f"[Pipeline] BBox: {bbox}")
-    except Exception as e:
-        return {
-            "query": query,
-            "place": place,
-            "error": f"Geocoding failed for '{place}': {str(e)}",
-            "success": False
-        }
-    
-    # ========== Step 6: OSM Extract (bbox -> sub pbf) ==========
-    place_slug = safe_slug(place)
-    sub_pbf = OUTPUT_DIR / f"sub_{place_slug}.osm.pbf"
-    
-    print(f"[Pipeline] Step 6: Extracting bbox subset to {sub_pbf}")
-    try:
-        osmium_extract_bbox(Path(OSM_PBF), sub_pbf, bbox)
-    except Exception as e:
-        return {
-            "query": query,
-            "place": place,
-            "chosen_tag": f"{key}={value}",
-            "error": f"OSM extraction failed: {str(e)}",
-            "success": False
-        }
-    
-    # ========== Step 7: Extract nodes -> GeoJSON ==========
-    print(f"[Pipeline] Step 7: Extracting nodes with {key}={value}")
-    try:
-        rows = extract_nodes_to_geojson(sub_pbf, key, value, Path(OUTPUT_GEOJSON))
-        print(f"[Pipeline] Extracted {len(rows)} nodes")
-    except Exception as e:
-        return {
-            "query": query,
-            "place": place,
-            "chosen_tag": f"{key}={value}",
-            "error": f"Node extraction failed: {str(e)}",
-            "success": False
-        }
+    cached = _load_cached_extract(place, key, value)
+    if cached:
+        bbox, count = cached["bbox"], cached["count"]
+    else:
+        # ========== Step 5: Geocode -> BBox ==========
+        print(f"[Pipeline] Step 5: Geocoding {place}")
+        try:
+            bbox = geocode_to_bbox(place)
+            print(f"[Pipeline] BBox: {bbox}")
+        except Exception as e:
+            return {
+                "query": query,
+                "place": place,
+                "error": f"Geocoding failed for '{place}': {str(e)}",
+                "success": False
+            }
+        
+        # ========== Step 6: OSM Extract (bbox + tag -> GeoJSON, 单次扫描) ==========
+        print(f"[Pipeline] Step 6: Extracting nodes with {key}={value} in bbox")
+        try:
+            count = _extract_to_cache(place, key, value, bbox)
+            print(f"[Pipeline] Extracted {count} nodes")
+        except Exception as e:
+            return {
+                "query": query,
+                "place": place,
+                "chosen_tag": f"{key}={value}",
+                "error": f"OSM extraction failed: {str(e)}",
+                "success": False
+            }
     
     # ========== 构建返回结果 ==========
     evidence = [
@@ -183,8 +301,8 @@ def run_query(query: str, model: str = "mistral") -> Dict[str, Any]:
         "place": place,
         "chosen_tag": f"{key}={value}",
         "bbox": bbox,
-        "count": len(rows),
-        "geojson_path": str(OUTPUT_GEOJSON),
+        "count": count,
+        **_result_files(place, key, value),
         "evidence": evidence,
         "llm_ok": llm_ok,
         "llm_raw": llm_res.get("raw", ""),
@@ -200,26 +318,21 @@ def run_query_without_llm(query: str, place: str, key: str, value: str) -> Dict[
     """
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     
-    # Geocode
-    try:
-        bbox = geocode_to_bbox(place)
-    except Exception as e:
-        return {"success": False, "error": f"Geocoding failed: {str(e)}"}
-    
-    # Extract
-    place_slug = safe_slug(place)
-    sub_pbf = OUTPUT_DIR / f"sub_{place_slug}.osm.pbf"
-    
-    try:
-        osmium_extract_bbox(Path(OSM_PBF), sub_pbf, bbox)
-    except Exception as e:
-        return {"success": False, "error": f"OSM extraction failed: {str(e)}"}
-    
-    # Nodes to GeoJSON
-    try:
-        rows = extract_nodes_to_geojson(sub_pbf, key, value, Path(OUTPUT_GEOJSON))
-    except Exception as e:
-        return {"success": False, "error": f"Node extraction failed: {str(e)}"}
+    cached = _load_cached_extract(place, key, value)
+    if cached:
+        bbox, count = cached["bbox"], cached["count"]
+    else:
+        # Geocode
+        try:
+            bbox = geocode_to_bbox(place)
+        except Exception as e:
+            return {"success": False, "error": f"Geocoding failed: {str(e)}"}
+        
+        # Extract bbox + tag -> GeoJSON
+        try:
+            count = _extract_to_cache(place, key, value, bbox)
+        except Exception as e:
+            return {"success": False, "error": f"OSM extraction failed: {str(e)}"}
     
     return {
         "success": True,
@@ -227,7 +340,7 @@ def run_query_without_llm(query: str, place: str, key: str, value: str) -> Dict[
         "place": place,
         "chosen_tag": f"{key}={value}",
         "bbox": bbox,
-        "count": len(rows),
-        "geojson_path": str(OUTPUT_GEOJSON),
+        "count": count,
+        **_result_files(place, key, value),
         "llm_ok": False,
     }
@@ -35,6 +35,10 @@ Examples:
 """
 
 
+# snippet 中的换行替换为空格 (str.translate 单次遍历)
+_NEWLINE_TO_SPACE = str.maketrans({"\n": " "})
+
+
 def format_evidence(chunks: List) -> str:
     """
     将 RAG 检索到的 chunks 格式化为 LLM 可读的证据文本
@@ -45,18 +49,15 @@ def format_evidence(chunks: List) -> str:
     Returns:
         格式化的证据字符串
     """
-    lines = []
-    for i, c in enumerate(chunks, 1):
-        # 截取 snippet，避免太长
-        snippet = c.page_content[:600].replace("\n", " ").strip()
-        lines.append(
-            f"[Evidence {i}]\n"
-            f"  Tag: {c.key}={c.value}\n"
-            f"  URL: {c.url}\n"
-            f"  Score: {c.score:.3f}\n"
-            f"  Content: {snippet}\n"
-        )
-    return "\n".join(lines)
+    # 截取 snippet，避免太长
+    return "\n".join(
+        f"[Evidence {i}]\n"
+        f"  Tag: {c.key}={c.value}\n"
+        f"  URL: {c.url}\n"
+        f"  Score: {c.score:.3f}\n"
+        f"  Content: {c.page_content[:600].translate(_NEWLINE_TO_SPACE).strip()}\n"
+        for i, c in enumerate(chunks, 1)
+    )
 
 
 def llm_parse_query(
@@ -0,0 +1,53 @@
+# cython: language_level=3
+# src/rag/_text_fast.pyx
+"""
+Cython build of clean_wiki_text / chunk_text (same behaviour as index_builder.py).
+Build in place with:  cythonize -i -3 src/rag/_text_fast.pyx
+"""
+import re
+
+_DROP_RE = re.compile(
+    r"^(?:Jump to navigation|Jump to search|From OpenStreetMap Wiki|In other languages"
+    r"|Other languages\.\.\.|Contents|Tools for this tag|More details at tag)$"
+)
+_WS_RE = re.compile(r"[ \t]+")
+
+
+cpdef str clean_wiki_text(str text):
+    cdef list lines = []
+    cdef str ln, s
+    cdef object drop_match = _DROP_RE.match
+
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    for ln in text.splitlines():
+        s = ln.strip()
+        if len(s) <= 2:  # covers empty lines and the language menu block
+            continue
+        if drop_match(s) is not None:
+            continue
+        lines.append(s)
+
+    return _WS_RE.sub(" ", "\n".join(lines))
+
+
+cpdef list chunk_text(str text, Py_ssize_t chunk_size=1200, Py_ssize_t overlap=150):
+    cdef list chunks = []
+    cdef Py_ssize_t start = 0
+    cdef Py_ssize_t end
+    cdef Py_ssize_t n = len(text)
+    cdef str chunk
+
+    if chunk_size <= overlap:
+        raise ValueError("chunk_size must be > overlap")
+
+    while start < n:
+        end = start + chunk_size
+        if end > n:
+            end = n
+        chunk = text[start:end].strip()
+        if len(chunk) >= 200:  # ignore tiny junk
+            chunks.append(chunk)
+        if end == n:
+            break
+        start = end - overlap
+    return chunks
@@ -0,0 +1,114 @@
+# src/rag/embedding.py
+"""
+Embedding 模型加载 - 索引构建与检索共用
+"""
+from __future__ import annotations
+
+from typing import List, Union
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from src.config import (
+    EMBEDDING_DEVICE, EMBEDDING_USE_ONNX, ONNX_MODEL_DIR, ONNX_MODEL_FILE, TORCH_COMPILE, TORCH_THREADS,
+)
+
+# CPU 推理的矩阵运算线程数；inter-op 线程设为 1，避免与 intra-op 线程争抢核心
+torch.set_num_threads(TORCH_THREADS)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    # 已有并行任务启动后 torch 不允许再修改 inter-op 线程数
+    pass
+
+
+def pick_device() -> str:
+    """返回 GEOAI_DEVICE 指定的设备；未指定时有 CUDA 则用 cuda，否则 cpu"""
+    if EMBEDDING_DEVICE:
+        return EMBEDDING_DEVICE
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_embedding_model(model_name: str) -> SentenceTransformer:
+    """
+    加载 Sentence Transformer 模型 (仅用于推理)
+    在 GPU 上转为 fp16 推理；编码结果由调用方统一转回 float32 再交给 FAISS
+    GEOAI_TORCH_COMPILE=1 时用 torch.compile 编译内部的 transformer
+    """
+    device = pick_device()
+    model = SentenceTransformer(model_name, device=device)
+    if device.startswith("cuda"):
+        model.half()
+    model.eval()
+    model.requires_grad_(False)
+    
+    if TORCH_COMPILE:
+        transformer = model[0]
+        eager_model = transformer.auto_model
+        try:
+            transformer.auto_model = torch.compile(eager_model, mode="reduce-overhead", dynamic=True)
+            # torch.compile 是惰性的：编译/后端错误在第一次前向时才出现，这里先预热一次
+            with torch.inference_mode():
+                model.encode(["warmup"])
+        except Exception as e:
+            transformer.auto_model = eager_model
+            print(f"[Embedding] torch.compile failed, using eager mode: {e}")
+    return model
+
+
+class OnnxEncoder:
+    """
+    ONNX Runtime 版本的句向量编码器 (查询时使用)
+    与 SentenceTransformer.encode 接口兼容：分词 -> ONNX 前向 -> 按 attention mask 做 mean pooling
+    向量不在这里归一化，由调用方统一用 faiss.normalize_L2 处理
+    """
+    
+    def __init__(self, model_dir=ONNX_MODEL_DIR, model_file: str = ONNX_MODEL_FILE, max_seq_length: int = 256):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.session = ort.InferenceSession(
+            str(model_dir / model_file),
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.max_seq_length = max_seq_length
+    
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """编码一条或多条文本，返回 float32 矩阵 (单条输入时返回一维向量)"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            tokens = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feeds = {name: arr.astype(np.int64) for name, arr in tokens.items() if name in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+            
+            # mean pooling (忽略 padding 位置)
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            outputs.append(pooled.astype(np.float32))
+        
+        embeddings = np.concatenate(outputs, axis=0)
+        return embeddings[0] if single else embeddings
+
+
+def load_query_encoder(model_name: str):
+    """
+    加载查询编码器：GEOAI_USE_ONNX=1 时使用导出的 ONNX 模型，否则使用 Sentence Transformer
+    ONNX 模型须与构建索引时的 model_name 是同一个模型
+    """
+    if EMBEDDING_USE_ONNX:
+        print(f"[Embedding] Using ONNX Runtime model: {ONNX_MODEL_DIR / ONNX_MODEL_FILE}")
+        return OnnxEncoder()
+    return load_embedding_model(model_name)
@@ -2,15 +2,23 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
-import json
+import hashlib
+import os
 import re
-from typing import Iterable, List, Dict
+import zipfile
+from typing import Iterable, Iterator, List, Dict
 
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import torch
 from tqdm import tqdm
 
+from src.config import FAISS_HNSW_EF_SEARCH
+from src.rag.embedding import load_embedding_model
+
 
 @dataclass
 class Chunk:
@@ -23,10 +31,21 @@ class Chunk:
 
 def _infer_key_value_from_url(url: str) -> tuple[str | None, str | None]:
     # e.g. https://wiki.openstreetmap.org/wiki/Tag:amenity%3Dcafe
-    m = re.search(r"Tag:([^%]+)%3D(.+)$", url)
-    if not m:
+    i = url.find("Tag:")
+    if i < 0:
+        return None, None
+    key, sep, value = url[i + 4:].partition("%3D")
+    if not sep or not key or not value or "%" in key:
         return None, None
-    return m.group(1), m.group(2)
+    return key, value
+
+
+# super noisy lines, dropped whole (one alternation instead of a pattern per line)
+_DROP_RE = re.compile(
+    r"^(?:Jump to navigation|Jump to search|From OpenStreetMap Wiki|In other languages"
+    r"|Other languages\.\.\.|Contents|Tools for this tag|More details at tag)$"
+)
+_WS_RE = re.compile(r"[ \t]+")
 
 
 def clean_wiki_text(text: str) -> str:
@@ -37,24 +56,12 @@ def clean_wiki_text(text: str) -> str:
     # normalize newlines
     text = text.replace("\r\n", "\n").replace("\r", "\n")
 
-    # drop super noisy lines
-    drop_patterns = [
-        r"^Jump to navigation$",
-        r"^Jump to search$",
-        r"^From OpenStreetMap Wiki$",
-        r"^In other languages$",
-        r"^Other languages\.\.\.$",
-        r"^Contents$",
-        r"^Tools for this tag$",
-        r"^More details at tag$",
-    ]
-
     lines = []
     for ln in text.splitlines():
         s = ln.strip()
         if not s:
             continue
-        if any(re.match(pat, s) for pat in drop_patterns):
+        if _DROP_RE.match(s):
             continue
         # remove the huge language menu block heuristically
         if len(s) <= 2:
@@ -63,7 +70,7 @@ def clean_wiki_text(text: str) -> str:
 
     # collapse repeated spaces
     cleaned = "\n".join(lines)
-    cleaned = re.sub(r"[ \t]+", " ", cleaned)
+    cleaned = _WS_RE.sub(" ", cleaned)
 
     # optionally truncate extremely long pages (MVP safety)
     return cleaned
@@ -77,29 +84,90 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 150) -> List[st
     if chunk_size <= overlap:
         raise ValueError("chunk_size must be > overlap")
 
-    chunks = []
-    start = 0
+    # Windows start every (chunk_size - overlap) chars; the last one is the first that reaches the end.
     n = len(text)
-    while start < n:
-        end = min(start + chunk_size, n)
-        chunk = text[start:end].strip()
-        if len(chunk) >= 200:  # ignore tiny junk
-            chunks.append(chunk)
-        if end == n:
-            break
-        start = end - overlap
-    return chunks
+    stride = chunk_size - overlap
+    pieces = (text[start:start + chunk_size].strip() for start in range(0, max(n - overlap, 1), stride))
+    return [p for p in pieces if len(p) >= 200]  # ignore tiny junk
 
 
-def load_wiki_raw_jsonl(path: Path) -> List[Dict]:
-    rows = []
-    with path.open("r", encoding="utf-8") as f:
+# Use the compiled versions when src/rag/_text_fast.pyx has been built (see README).
+try:
+    from src.rag._text_fast import chunk_text, clean_wiki_text  # noqa: F811
+except ImportError:
+    pass
+
+
+def iter_wiki_raw_jsonl(path: Path) -> Iterator[Dict]:
+    """Yield one scraped page per non-empty JSONL line."""
+    with path.open("rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            rows.append(json.loads(line))
-    return rows
+            if line.strip():
+                yield orjson.loads(line)
+
+
+def load_wiki_raw_jsonl(path: Path) -> List[Dict]:
+    return list(iter_wiki_raw_jsonl(path))
+
+
+def _encode_texts(model, texts: List[str], out: np.ndarray, rows: List[int], batch_size: int = 64) -> None:
+    """
+    Embed texts and write embedding j into out[rows[j]].
+    Texts are sorted by length so each batch holds similar-length texts and pads less,
+    then encoded one batch at a time: only a (batch_size, dim) block is alive besides `out`.
+    Each block is L2-normalized with faiss.normalize_L2 before it is written.
+    """
+    order = np.argsort([len(t) for t in texts], kind="stable")
+    sorted_rows = np.asarray(rows)[order]
+    for start in tqdm(range(0, len(texts), batch_size), desc="Embedding"):
+        batch = order[start:start + batch_size]
+        with torch.inference_mode():
+            block = np.ascontiguousarray(
+                model.encode([texts[i] for i in batch], batch_size=batch_size, convert_to_numpy=True),
+                dtype=np.float32,
+            )
+        faiss.normalize_L2(block)
+        out[sorted_rows[start:start + batch_size]] = block
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _embedding_cache_path(index_path: Path) -> Path:
+    return index_path.with_name(index_path.name + ".embeddings.npz")
+
+
+def _load_embedding_cache(path: Path, model_name: str) -> Dict[str, np.ndarray]:
+    """
+    Load {sha1(page_content): embedding} saved by a previous build.
+    The cache is discarded if it was built with a different model.
+    """
+    if not path.exists():
+        return {}
+    try:
+        with np.load(path) as data:
+            if str(data["model"]) != model_name:
+                print(f"Embedding cache was built with {data['model']}, ignoring it")
+                return {}
+            return dict(zip(data["hashes"].tolist(), data["embeddings"]))
+    except (OSError, ValueError, zipfile.BadZipFile, KeyError) as e:
+        print(f"Embedding cache {path} is unreadable ({e}), ignoring it")
+        return {}
+
+
+def _save_embedding_cache(path: Path, model_name: str, hashes: List[str], embeddings: np.ndarray) -> None:
+    """Save embeddings of the current chunks only, so the cache does not grow across rebuilds."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temp file and swap it in, so an interrupted build never leaves a truncated cache
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with tmp.open("wb") as f:
+            np.savez(f, model=np.array(model_name), hashes=np.array(hashes), embeddings=embeddings)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 
 def build_faiss_index(
@@ -110,10 +178,8 @@ def build_faiss_index(
     chunk_size: int = 1200,
     overlap: int = 150,
 ) -> None:
-    rows = load_wiki_raw_jsonl(wiki_raw_jsonl)
-
     all_chunks: List[Chunk] = []
-    for r in rows:
+    for r in iter_wiki_raw_jsonl(wiki_raw_jsonl):
         url = r.get("url", "")
         title = r.get("title", "")
         raw_text = r.get("text", "")
@@ -130,38 +196,66 @@ def build_faiss_index(
 
     print(f"Total chunks: {len(all_chunks)}")
 
-    model = SentenceTransformer(embedding_model_name)
     texts = [c.page_content for c in all_chunks]
+    hashes = [_text_hash(t) for t in texts]
+
+    # Only chunks whose text is not in the embedding cache go through the model,
+    # and identical chunk texts (shared boilerplate across pages) are embedded once.
+    cache_path = _embedding_cache_path(index_path)
+    cache = _load_embedding_cache(cache_path, embedding_model_name)
+    misses = [i for i, h in enumerate(hashes) if h not in cache]
+    first_row: Dict[str, int] = {}
+    for i in misses:
+        first_row.setdefault(hashes[i], i)
+    unique_misses = list(first_row.values())
+    print(f"Embedding cache: {len(texts) - len(misses)} hits, {len(unique_misses)} unique texts to embed")
 
-    # Embed
-    emb_list = []
-    for t in tqdm(texts, desc="Embedding"):
-        v = model.encode(t, normalize_embeddings=True)
-        emb_list.append(v.astype(np.float32))
-    embeddings = np.vstack(emb_list).astype(np.float32)
+    # Fill one preallocated float32 matrix: cached rows first, then the new embeddings
+    model = load_embedding_model(embedding_model_name) if misses else None
+    if cache:
+        dim = next(iter(cache.values())).shape[0]
+    else:
+        dim = model.get_sentence_embedding_dimension()
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+    for i, h in enumerate(hashes):
+        emb = cache.get(h)
+        if emb is not None:
+            embeddings[i] = emb
+    if misses:
+        _encode_texts(model, [texts[i] for i in unique_misses], embeddings, unique_misses)
+        for i in misses:
+            j = first_row[hashes[i]]
+            if j != i:
+                embeddings[i] = embeddings[j]
+    _save_embedding_cache(cache_path, embedding_model_name, hashes, embeddings)
 
-    # Build FAISS (cosine similarity via inner product on normalized vectors)
+    # Build FAISS (cosine similarity via inner product on normalized vectors).
+    # HNSW graph gives sub-linear search; vectors are stored as 8-bit scalars
+    # (4x smaller than float32), so the quantizer is trained on the embeddings first.
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
+    index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = 40
+    index.train(embeddings)
+    # index.add stays on CPU: FAISS has no GPU implementation of HNSW
     index.add(embeddings)
+    index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
 
     # Save
     index_path.parent.mkdir(parents=True, exist_ok=True)
     faiss.write_index(index, str(index_path))
 
-    metadata = [
+    # Columnar metadata (one column per field, row i <-> vector i)
+    metadata = pa.table(
         {
-            "page_content": c.page_content,
-            "url": c.url,
-            "title": c.title,
-            "key": c.key,
-            "value": c.value,
+            "page_content": [c.page_content for c in all_chunks],
+            "url": [c.url for c in all_chunks],
+            "title": [c.title for c in all_chunks],
+            "key": pa.array([c.key for c in all_chunks], type=pa.string()),
+            "value": pa.array([c.value for c in all_chunks], type=pa.string()),
         }
-        for c in all_chunks
-    ]
+    )
     metadata_path.parent.mkdir(parents=True, exist_ok=True)
-    with metadata_path.open("w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    pq.write_table(metadata, str(metadata_path))
 
     print(f"Saved FAISS index: {index_path}")
     print(f"Saved metadata:   {metadata_path}")
@@ -3,15 +3,19 @@
 RAG 检索器 - 使用 FAISS 进行语义搜索
 """
 from __future__ import annotations
+import functools
 import json
 from dataclasses import dataclass
+from pathlib import Path
 from typing import List, Dict, Tuple
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import pyarrow.parquet as pq
+import torch
 
-from src.config import FAISS_INDEX, FAISS_META
+from src.config import FAISS_HNSW_EF_SEARCH, FAISS_INDEX, FAISS_META
+from src.rag.embedding import load_query_encoder
 
 
 @dataclass
@@ -25,6 +29,54 @@ class RetrievedChunk:
     value: str | None     # OSM tag value (如 "cafe")
 
 
+META_COLUMNS = ("page_content", "url", "title", "key", "value")
+
+
+def _read_metadata(meta_path: str) -> Dict[str, np.ndarray]:
+    """
+    读取元数据，返回 {列名: 数组}，第 i 行对应索引中的第 i 个向量
+    支持 parquet 列式文件；旧版 .json (list of dict) 也转换为同样的列结构
+    (parquet 不存在但同名 .json 存在时读取旧版文件，无需重建索引)
+    """
+    legacy_path = Path(meta_path).with_suffix(".json")
+    if not Path(meta_path).exists() and legacy_path.exists():
+        meta_path = str(legacy_path)
+    
+    if meta_path.endswith(".json"):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            rows: List[Dict] = json.load(f)
+        return {
+            col: np.array([row.get(col) for row in rows], dtype=object)
+            for col in META_COLUMNS
+        }
+    
+    table = pq.read_table(meta_path, columns=list(META_COLUMNS))
+    return {
+        col: table.column(col).to_numpy(zero_copy_only=False)
+        for col in META_COLUMNS
+    }
+
+
+@functools.lru_cache(maxsize=4)
+def _load_retriever_resources(model_name: str, index_path: str, meta_path: str):
+    """
+    加载 (模型, FAISS 索引, 元数据)，按参数在进程内缓存
+    同一进程中重复构造 FaissRetriever 时不再重新读取磁盘和初始化模型
+    """
+    print(f"[Retriever] Loading model: {model_name}")
+    model = load_query_encoder(model_name)
+    
+    print(f"[Retriever] Loading FAISS index: {index_path}")
+    index = faiss.read_index(index_path)
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    
+    print(f"[Retriever] Loading metadata: {meta_path}")
+    meta = _read_metadata(meta_path)
+    
+    return model, index, meta
+
+
 class FaissRetriever:
     """
     FAISS 向量检索器
@@ -43,19 +95,19 @@ class FaissRetriever:
         Args:
             model_name: Sentence Transformer 模型名称
             index_path: FAISS 索引文件路径
-            meta_path: 元数据 JSON 文件路径
+            meta_path: 元数据文件路径 (.parquet，兼容旧版 .json)
         """
-        print(f"[Retriever] Loading model: {model_name}")
-        self.model = SentenceTransformer(model_name)
-        
-        print(f"[Retriever] Loading FAISS index: {index_path}")
-        self.index = faiss.read_index(str(index_path))
-        
-        print(f"[Retriever] Loading metadata: {meta_path}")
-        with open(meta_path, "r", encoding="utf-8") as f:
-            self.meta: List[Dict] = json.load(f)
+        self.model, self.index, meta = _load_retriever_resources(
+            model_name, str(index_path), str(meta_path)
+        )
+        self._content = meta["page_content"]
+        self._url = meta["url"]
+        self._title = meta["title"]
+        self._key = meta["key"]
+        self._value = meta["value"]
+        self._n = len(self._content)
         
-        print(f"[Retriever] Loaded {len(self.meta)} chunks")
+        print(f"[Retriever] Loaded {self._n} chunks")
 
     def retrieve(self, query: str, k: int = 5) -> List[RetrievedChunk]:
         """
@@ -68,34 +120,53 @@ class FaissRetriever:
         Returns:
             RetrievedChunk 列表，按相似度降序排列
         """
-        # 将查询编码为向量
-        query_vector = self.model.encode(
-            query,
-            normalize_embeddings=True
-        ).astype(np.float32)[None, :]
+        return self.retrieve_batch([query], k)[0]
+
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[RetrievedChunk]]:
+        """
+        批量检索：一次编码全部查询，一次 FAISS 搜索
+        (FAISS 对单个向量的搜索不会使用多线程，批量提交才能并行)
+        
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的结果数量
+        
+        Returns:
+            与 queries 一一对应的 RetrievedChunk 列表
+        """
+        # 将查询编码为向量矩阵 (GPU 上模型为 fp16，这里统一转回 float32)
+        with torch.inference_mode():
+            query_vectors = np.ascontiguousarray(
+                self.model.encode(queries, convert_to_numpy=True),
+                dtype=np.float32,
+            )
+        # 整个矩阵一次性做 L2 归一化 (内积即余弦相似度)
+        faiss.normalize_L2(query_vectors)
         
         # FAISS 搜索
-        distances, indices = self.index.search(query_vector, k)
+        distances, indices = self.index.search(query_vectors, k)
         
         # 构建结果
-        results: List[RetrievedChunk] = []
-        for rank, idx in enumerate(indices[0]):
-            if idx < 0 or idx >= len(self.meta):
-                continue
-            
-            meta = self.meta[int(idx)]
-            results.append(
-                RetrievedChunk(
-                    score=float(distances[0][rank]),
-                    page_content=meta.get("page_content", ""),
-                    url=meta.get("url", ""),
-                    title=meta.get("title", ""),
-                    key=meta.get("key"),
-                    value=meta.get("value"),
+        batch_results: List[List[RetrievedChunk]] = []
+        for row_distances, row_indices in zip(distances, indices):
+            results: List[RetrievedChunk] = []
+            for score, idx in zip(row_distances, row_indices):
+                if idx < 0 or idx >= self._n:
+                    continue
+                
+                results.append(
+                    RetrievedChunk(
+                        score=float(score),
+                        page_content=self._content[idx] or "",
+                        url=self._url[idx] or "",
+                        title=self._title[idx] or "",
+                        key=self._key[idx],
+                        value=self._value[idx],
+                    )
                 )
-            )
+            batch_results.append(results)
         
-        return results
+        return batch_results
 
 
 def pick_tag_from_chunks(chunks: List[RetrievedChunk]) -> Tuple[str, str]: